@@ -5,38 +5,90 @@ import numpy as np
 
 tfk = tf.keras
 
+def enable_mixed_precision():
+     """Activează mixed precision: bfloat16 pe Ampere+, float16 pe GPU-uri mai vechi, float32 pe CPU"""
+     gpus = tf.config.list_physical_devices('GPU')
+     if not gpus:
+          # Majoritatea CPU-urilor (fără AMX/AVX512-BF16) rulează bf16 mai încet decât float32
+          tfk.mixed_precision.set_global_policy('float32')
+          return 'float32'
+
+     policy = 'mixed_bfloat16'
+     for gpu in gpus:
+          capability = tf.config.experimental.get_device_details(gpu).get('compute_capability')
+          if capability and capability < (8, 0):
+               policy = 'mixed_float16'
+               break
+
+     tfk.mixed_precision.set_global_policy(policy)
+     return policy
+
+class FusedProjection(tfk.layers.Layer):
+    """Dense -> ReLU -> Dropout -> Dense -> LayerNorm ca o singură funcție compilată XLA"""
+    def __init__(self, hidden_dim, embedding_dim, dropout_rate=0.1, epsilon=1e-3, **kwargs):
+        super().__init__(**kwargs)
+        self.hidden_dim = hidden_dim
+        self.embedding_dim = embedding_dim
+        self.dropout_rate = dropout_rate
+        self.epsilon = epsilon
+    
+    def build(self, input_shape):
+        input_dim = int(input_shape[-1])
+        
+        self.W1 = self.add_weight(name='W1', shape=(input_dim, self.hidden_dim), initializer='glorot_uniform')
+        self.b1 = self.add_weight(name='b1', shape=(self.hidden_dim,), initializer='zeros')
+        self.W2 = self.add_weight(name='W2', shape=(self.hidden_dim, self.embedding_dim), initializer='glorot_uniform')
+        self.b2 = self.add_weight(name='b2', shape=(self.embedding_dim,), initializer='zeros')
+        self.ln_gamma = self.add_weight(name='ln_gamma', shape=(self.embedding_dim,), initializer='ones')
+        self.ln_beta = self.add_weight(name='ln_beta', shape=(self.embedding_dim,), initializer='zeros')
+        
+        super().build(input_shape)
+    
+    @tf.function(jit_compile=True)
+    def fused_project(self, x, training):
+        h = tf.nn.relu(tf.matmul(x, self.W1) + self.b1)
+        if training:
+            h = tf.nn.dropout(h, rate=self.dropout_rate)
+        
+        # LayerNorm în float32 (ca LayerNormalization sub mixed precision)
+        y = tf.cast(tf.matmul(h, self.W2) + self.b2, tf.float32)
+        mean, var = tf.nn.moments(y, axes=[-1], keepdims=True)
+        normalized = (y - mean) * tf.math.rsqrt(var + self.epsilon)
+        
+        return tf.cast(self.ln_gamma, tf.float32) * normalized + tf.cast(self.ln_beta, tf.float32)
+    
+    def call(self, inputs, training=False):
+        return self.fused_project(inputs, training)
+
 class JapaneseSentenceEmbedder(tfk.Model):
      def __init__(self, base_model_name='cl-tohoku/bert-base-japanese-v3', 
                  embedding_dim=768, hidden_dim=512, dropout_rate=0.1):
         super().__init__()
 
+        self.embedding_dim = embedding_dim
         self.encoder = TFAutoModel.from_pretrained(base_model_name)
         self.tokenizer = AutoTokenizer.from_pretrained(base_model_name)
 
         
-        self.projection = tfk.Sequential([
-            tfk.layers.Dense(hidden_dim, activation='relu'),
-            tfk.layers.Dropout(dropout_rate),
-            tfk.layers.Dense(embedding_dim),
-            tfk.layers.LayerNormalization()
-        ])
+        self.projection = FusedProjection(hidden_dim, embedding_dim, dropout_rate)
 
         #For fine tunning purposes
         self.encoder.trainable = False
 
+     # Fără jit_compile aici: XLA compilează per formă, iar encode() trimite lungimi diferite
+     # la fiecare batch. Pe calea de training e fuzionat în pașii compilați XLA care îl apelează.
+     @tf.function(reduce_retracing=True)
      def mean_pooling(self, token_embbedings, attention_mask):
-          input_mask_expanded = tf.cast(
-                  tf.expand_dims(attention_mask, -1),
-                  token_embbedings.dtype
-              )   
-          sum_embbedings = tf.reduce_sum(token_embbedings * input_mask_expanded,axis=1)
-          sum_mask = tf.maximum(tf.reduce_sum(input_mask_expanded,axis=1),1e-9)
-
-          return sum_embbedings / sum_mask
-     
+          # Masca se convertește o singură dată
+          input_mask = tf.cast(attention_mask, token_embbedings.dtype)
+          sum_embbedings = tf.reduce_sum(token_embbedings * input_mask[:, :, None], axis=1)
+          inv_sum_mask = tf.math.reciprocal_no_nan(tf.reduce_sum(input_mask, axis=1, keepdims=True))
 
-     def call(self, input_ids, attention_mask, training=False):
+          return sum_embbedings * inv_sum_mask
+     
 
+     def pool(self, input_ids, attention_mask, training=False):
+          """Encoder + mean pooling (determinist cât timp encoder-ul e înghețat)"""
           outputs = self.encoder(input_ids=input_ids,
                                  attention_mask=attention_mask,
                                  training=training
@@ -44,67 +96,146 @@ class JapaneseSentenceEmbedder(tfk.Model):
 
           # Mean Pooling
           token_embeddings = outputs.last_hidden_state
-          sentence_embeddings = self.mean_pooling(token_embeddings, attention_mask)
+          return self.mean_pooling(token_embeddings, attention_mask)
 
-          # Projection
+     def project(self, sentence_embeddings, training=False):
+          """Projection head + L2 normalization"""
           projected = self.projection(sentence_embeddings, training=training)
 
-          # L2 normalization for cosine similarity
-          normalized = tf.nn.l2_normalize(projected, axis=1)
+          # L2 normalization for cosine similarity (in float32 under mixed precision)
+          return tf.nn.l2_normalize(tf.cast(projected, tf.float32), axis=1)
 
-          return normalized
+     def projection_head(self):
+          """Projection + L2 normalization ca model Keras separat (pentru export)"""
+          inputs = tfk.Input(shape=(self.encoder.config.hidden_size,), dtype=tf.float32)
+          return tfk.Model(inputs, self.project(inputs))
 
-     def encode(self, texts, batch_size=32):
+     def call(self, input_ids, attention_mask, training=False):
 
-          if isinstance(texts, str):
-               texts = [texts]
+          sentence_embeddings = self.pool(input_ids, attention_mask, training=training)
 
-          all_embeddings = []
+          return self.project(sentence_embeddings, training=training)
 
-          for i in range(0, len(texts), batch_size):
-               batch_texts = texts[i:i+batch_size]
+     def encode(self, texts, batch_size=32, out_path=None):
+          """Returnează embeddings (N, embedding_dim); cu out_path scrie direct într-un .npy memmap"""
 
-               # Tokenization
-               encoded = self.tokenizer(
-                    batch_texts,
-                    padding=True,
-                    truncation=True,
-                    max_length=512,
-                    return_tensors='tf'
-               )
+          if isinstance(texts, str):
+               texts = [texts]
+
+          # Tokenization (o singură dată, fără padding)
+          encoded = self.tokenizer(
+               list(texts),
+               padding=False,
+               truncation=True,
+               max_length=512
+          )
+          input_ids = encoded['input_ids']
+
+          # Sortare după lungime ca fiecare batch să fie padat doar până la maximul lui
+          order = np.argsort([len(ids) for ids in input_ids], kind='stable')
+          pad_id = self.tokenizer.pad_token_id or 0
+
+          shape = (len(input_ids), self.embedding_dim)
+          if out_path is not None:
+               # Pentru corpusuri mari: rezultatele merg pe disc, nu în RAM
+               out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=shape)
+          else:
+               out = np.empty(shape, dtype=np.float32)
+
+          for i in range(0, len(order), batch_size):
+               batch_idx = order[i:i+batch_size]
+               max_len = len(input_ids[batch_idx[-1]])
+
+               batch_ids = np.full((len(batch_idx), max_len), pad_id, dtype=np.int32)
+               batch_mask = np.zeros((len(batch_idx), max_len), dtype=np.int32)
+               for row, idx in enumerate(batch_idx):
+                    ids = input_ids[idx]
+                    batch_ids[row, :len(ids)] = ids
+                    batch_mask[row, :len(ids)] = 1
 
                embeddings = self(
-                    input_ids=encoded['input_ids'],
-                    attention_mask=encoded['attention_mask'],
+                    input_ids=batch_ids,
+                    attention_mask=batch_mask,
                     training=False
                )
 
-               all_embeddings.append(embeddings.numpy())
+               out[batch_idx] = embeddings.numpy()
+
+          if out_path is not None:
+               out.flush()
+
+          return out
 
-          return np.vstack(all_embeddings)
+     def transformer_layers(self):
+          """Straturile transformer ale encoder-ului (TFBertModel -> .bert.encoder.layer)"""
+          main_layer = getattr(self.encoder, self.encoder.base_model_prefix)
+          return main_layer.encoder.layer
 
-     def unfreeze_encoder(self, num_layers=4):
+     def unfreeze_encoder(self, num_layers=4, gradient_checkpointing=False):
           self.encoder.trainable = True
 
-          for layer in self.encoder.encoder.layer[:-num_layers]:
+          # Embeddings și pooler rămân înghețate: se antrenează doar ce salvează checkpoint()
+          main_layer = getattr(self.encoder, self.encoder.base_model_prefix)
+          main_layer.embeddings.trainable = False
+          if getattr(main_layer, 'pooler', None) is not None:
+               main_layer.pooler.trainable = False
+
+          for layer in self.transformer_layers()[:-num_layers]:
                layer.trainable = False
 
+          # Opțional: activările se recalculează în backward în loc să stea în VRAM,
+          # dar straturile deblocate pierd dropout-ul (vezi recompute_grad_call)
+          if gradient_checkpointing:
+               for layer in self.transformer_layers()[-num_layers:]:
+                    layer.call = self.recompute_grad_call(layer.call)
+
+     def checkpoint(self, num_layers=4, **kwargs):
+          """Checkpoint doar pentru projection + straturile care se antrenează (restul = BERT pre-antrenat)"""
+          return tf.train.Checkpoint(
+               projection=self.projection,
+               top_layers=list(self.transformer_layers()[-num_layers:]),
+               **kwargs
+          )
+
+     @staticmethod
+     def recompute_grad_call(call):
+          """Învelește call-ul unui strat transformer în tf.recompute_grad
+
+          tf.recompute_grad reia forward-ul în backward fără să restaureze starea RNG,
+          deci dropout-ul ar genera alte măști decât cele folosite la loss. Straturile
+          învelite rulează de aceea fără dropout (training=False).
+          """
+          def checkpointed_call(hidden_states, attention_mask=None, *args, **kwargs):
+               kwargs['training'] = False
+               if attention_mask is None:
+                    forward = lambda h: call(h, None, *args, **kwargs)
+                    return tf.recompute_grad(forward)(hidden_states)
+
+               forward = lambda h, mask: call(h, mask, *args, **kwargs)
+               return tf.recompute_grad(forward)(hidden_states, attention_mask)
+
+          return checkpointed_call
+
 class ContrastiveLoss(tf.keras.losses.Loss):
-    """Loss pentru contrastive learning (similar cu Sentence-BERT)"""
+    """InfoNCE cu negative in-batch: pentru B perechi pozitive, celelalte B-1 răspunsuri din batch sunt negative"""
     def __init__(self, temperature=0.05):
-        super().__init__()
+        # Reducerea se face în call; NONE e necesar în bucle custom cu tf.distribute
+        super().__init__(reduction=tf.keras.losses.Reduction.NONE)
         self.temperature = temperature
-        self.cosine_sim = tfk.losses.CosineSimilarity(axis=1)
     
-    def call(self, embeddings1, embeddings2, labels):
-        # Cosine similarity
-        similarity = 1 - self.cosine_sim(embeddings1, embeddings2)
+    def call(self, embeddings1, embeddings2):
+        # Perechea pozitivă pentru rândul i este coloana i (diagonala)
+        labels = tf.range(tf.shape(embeddings1)[0])
+
+        # Pe mai multe replici negativele vin din tot batch-ul global, nu doar din shard-ul local
+        context = tf.distribute.get_replica_context()
+        if context is not None and context.num_replicas_in_sync > 1:
+            embeddings2 = context.all_gather(embeddings2, axis=0)
+            replica_id = tf.cast(context.replica_id_in_sync_group, tf.int32)
+            labels += replica_id * tf.shape(embeddings1)[0]
+
+        # Embeddings-urile sunt deja L2-normalizate -> matmul = matricea de cosine similarity (B x B_global)
+        logits = tf.matmul(embeddings1, embeddings2, transpose_b=True) / self.temperature
         
-        # Contrastive loss
-        positive_loss = labels * tf.square(1 - similarity)
-        negative_loss = (1 - labels) * tf.square(tf.maximum(similarity, 0))
-        
-        loss = positive_loss + negative_loss
-        return tf.reduce_mean(loss)        
-
-
+        loss = tf.nn.sparse_softmax_cross_entropy_with_logits(labels=labels, logits=logits)
+        return tf.reduce_mean(loss)
@@ -1,57 +1,83 @@
 # chromaDB-development_and_AI_stuff/scripts/prepare_training_data.py
-import json
+import hashlib
+import itertools
+import ijson
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
+def texts_fingerprint(texts, *settings):
+    """sha256 peste setări (model, max_length, ...) și texte"""
+    digest = hashlib.sha256('\0'.join(map(str, settings)).encode('utf-8'))
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def tokens_fingerprint(df, tokenizer_name, max_length):
+    """Amprentă pentru token-urile salvate: textele, tokenizer-ul și max_length"""
+    texts = itertools.chain(df['text1'].astype(str), df['text2'].astype(str))
+    return texts_fingerprint(texts, tokenizer_name, max_length)
+
 class JapaneseEmbeddingDataPrep:
-    def __init__(self, conversations_path, grammar_path):
+    def __init__(self, conversations_path, grammar_path,
+                 tokenizer_name='cl-tohoku/bert-base-japanese-v3', max_length=512):
         self.conversations_path = Path(conversations_path)
         self.grammar_path = Path(grammar_path)
+        self.tokenizer_name = tokenizer_name
+        self.max_length = max_length
+        self.tokenizer = None
         
+    def iter_conversations(self):
+        """Parcurge conversațiile în streaming (memorie O(o conversație))"""
+        with open(self.conversations_path, 'rb') as f:
+            for conv_id, conv in ijson.kvitems(f, ''):
+                yield conv_id, conv
+    
     def load_conversations(self):
         """Încarcă conversațiile și extrage perechi Q&A"""
-        with open(self.conversations_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
         pairs = []
-        for conv_id, conv in data.items():
+        for conv_id, conv in self.iter_conversations():
             messages = conv.get('messages', [])
             for i in range(0, len(messages)-1, 2):
                 if messages[i]['role'] == 'user' and messages[i+1]['role'] == 'assistant':
                     pairs.append({
                         'query': messages[i]['content'],
-                        'response': messages[i+1]['content'],
-                        'label': 1  # positive pair
+                        'response': messages[i+1]['content']
                     })
         return pairs
     
     def create_contrastive_pairs(self, pairs):
-        """Creează perechi pozitive și negative pentru contrastive learning"""
-        import random
-        
-        training_data = []
-        
-        # Positive pairs (query + correct response)
-        for pair in pairs:
-            training_data.append({
-                'text1': pair['query'],
-                'text2': pair['response'],
-                'label': 1
-            })
+        """Creează perechile pozitive (query, response); negativele vin din batch (InfoNCE)"""
+        return pd.DataFrame({
+            'text1': [pair['query'] for pair in pairs],
+            'text2': [pair['response'] for pair in pairs]
+        })
+    
+    def tokenize_dataset(self, df):
+        """Tokenizează fiecare coloană o singură dată, la pregătirea datelor"""
+        if self.tokenizer is None:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
         
-        # Negative pairs (query + random incorrect response)
-        for pair in pairs:
-            random_pair = random.choice(pairs)
-            while random_pair == pair:
-                random_pair = random.choice(pairs)
-            
-            training_data.append({
-                'text1': pair['query'],
-                'text2': random_pair['response'],
-                'label': 0
-            })
+        tokens = {}
+        for column, suffix in (('text1', '1'), ('text2', '2')):
+            encoded = self.tokenizer(
+                df[column].astype(str).tolist(),
+                padding='max_length',
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors='np'
+            )
+            tokens[f'ids{suffix}'] = encoded['input_ids'].astype(np.int32)
+            tokens[f'mask{suffix}'] = encoded['attention_mask'].astype(np.int32)
         
-        return pd.DataFrame(training_data)
+        return tokens
+    
+    def save_tokenized(self, df, path):
+        """Salvează token-urile ca .npz ca trainer-ul să nu re-tokenizeze"""
+        fingerprint = tokens_fingerprint(df, self.tokenizer_name, self.max_length)
+        np.savez(path, fingerprint=np.array(fingerprint), **self.tokenize_dataset(df))
     
     def prepare_dataset(self):
         """Pipeline complet de pregătire"""
@@ -84,9 +110,12 @@ if __name__ == "__main__":
     )
     train_df, val_df, test_df = prep.prepare_dataset()
 
-    train_df.to_csv(output_dir / 'train.csv', index=False)
-    val_df.to_csv(output_dir / 'val.csv', index=False)
-    test_df.to_csv(output_dir / 'test.csv', index=False)
+    train_df.to_parquet(output_dir / 'train.parquet', index=False, compression='zstd')
+    val_df.to_parquet(output_dir / 'val.parquet', index=False, compression='zstd')
+    test_df.to_parquet(output_dir / 'test.parquet', index=False, compression='zstd')
+
+    prep.save_tokenized(train_df, output_dir / 'train_tokens.npz')
+    prep.save_tokenized(val_df, output_dir / 'val_tokens.npz')
 
     print(f"✅ Training samples: {len(train_df)}")
     print(f"✅ Validation samples: {len(val_df)}")
@@ -10,14 +10,14 @@ This script handles:
 
 import sys
 from pathlib import Path
-import json
+import ijson
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from scripts.prepare_training_data import JapaneseEmbeddingDataPrep
 from scripts.train_embedder import EmbeddingTrainer
-from models.japanese_embedder import JapaneseSentenceEmbedder
+from models.japanese_embedder import JapaneseSentenceEmbedder, enable_mixed_precision
 import pandas as pd
 import tensorflow as tf
 
@@ -31,14 +31,15 @@ def check_data_availability():
         print("⚠️  No conversations.json found. Creating sample data...")
         return False
 
-    with open(conversations_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # Stream the file instead of loading it all just to count conversations
+    with open(conversations_path, 'rb') as f:
+        num_conversations = sum(1 for _ in ijson.kvitems(f, ''))
 
-    if len(data) == 0:
+    if num_conversations == 0:
         print("⚠️  conversations.json is empty. Need to collect more data.")
         return False
 
-    print(f"✅ Found {len(data)} conversations")
+    print(f"✅ Found {num_conversations} conversations")
     return True
 
 
@@ -60,9 +61,12 @@ def step1_prepare_data():
     try:
         train_df, val_df, test_df = prep.prepare_dataset()
 
-        train_df.to_csv(output_dir / 'train.csv', index=False)
-        val_df.to_csv(output_dir / 'val.csv', index=False)
-        test_df.to_csv(output_dir / 'test.csv', index=False)
+        train_df.to_parquet(output_dir / 'train.parquet', index=False, compression='zstd')
+        val_df.to_parquet(output_dir / 'val.parquet', index=False, compression='zstd')
+        test_df.to_parquet(output_dir / 'test.parquet', index=False, compression='zstd')
+
+        prep.save_tokenized(train_df, output_dir / 'train_tokens.npz')
+        prep.save_tokenized(val_df, output_dir / 'val_tokens.npz')
 
         print(f"✅ Training samples: {len(train_df)}")
         print(f"✅ Validation samples: {len(val_df)}")
@@ -87,8 +91,8 @@ def step2_train_model():
 
     # Load data
     try:
-        train_df = pd.read_csv(data_dir / 'train.csv')
-        val_df = pd.read_csv(data_dir / 'val.csv')
+        train_df = pd.read_parquet(data_dir / 'train.parquet')
+        val_df = pd.read_parquet(data_dir / 'val.parquet')
 
         print(f"📊 Loaded {len(train_df)} training samples")
         print(f"📊 Loaded {len(val_df)} validation samples")
@@ -98,11 +102,19 @@ def step2_train_model():
 
     # Initialize model
     try:
-        model = JapaneseSentenceEmbedder(
-            base_model_name='cl-tohoku/bert-base-japanese-v3',
-            embedding_dim=384,  # Compatible with ChromaDB
-            hidden_dim=512
-        )
+        # Mixed precision must be set before the model is built
+        print(f"⚡ Mixed precision policy: {enable_mixed_precision()}")
+
+        # Multi-GPU: the model must be built inside strategy.scope()
+        strategy = tf.distribute.MirroredStrategy()
+        print(f"🖥️  Replicas in sync: {strategy.num_replicas_in_sync}")
+
+        with strategy.scope():
+            model = JapaneseSentenceEmbedder(
+                base_model_name='cl-tohoku/bert-base-japanese-v3',
+                embedding_dim=384,  # Compatible with ChromaDB
+                hidden_dim=512
+            )
         print("✅ Model initialized")
     except Exception as e:
         print(f"❌ Error initializing model: {e}")
@@ -110,17 +122,54 @@ def step2_train_model():
 
     # Train
     try:
-        trainer = EmbeddingTrainer(model, learning_rate=2e-5)
-        trainer.train(train_df, val_df, epochs=10, batch_size=16)
+        trainer = EmbeddingTrainer(model, learning_rate=2e-5, cache_dir=data_dir,
+                                   strategy=strategy, accum_steps=1, checkpoint_dir=model_dir)
+        trainer.train(train_df, val_df, epochs=10, batch_size=32)
 
         print("🎉 Training complete!")
-        print(f"✅ Model saved to: {model_dir / 'best_embedder.h5'}")
+        print(f"✅ Model saved to: {model_dir}")
         return True
     except Exception as e:
         print(f"❌ Error during training: {e}")
         return False
 
 
+def export_quantized_model(model, output_dir):
+    """Export encoder + mean pooling as int8 ONNX and the projection head as TFLite"""
+    import tf2onnx
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Encoder + mean pooling -> pooled sentence vector
+    input_signature = (
+        tf.TensorSpec((None, None), tf.int32, name='input_ids'),
+        tf.TensorSpec((None, None), tf.int32, name='attention_mask'),
+    )
+
+    @tf.function(input_signature=input_signature)
+    def pooled_encoder(input_ids, attention_mask):
+        return model.pool(input_ids, attention_mask, training=False)
+
+    encoder_path = output_dir / 'encoder.onnx'
+    tf2onnx.convert.from_function(
+        pooled_encoder,
+        input_signature=input_signature,
+        opset=17,
+        output_path=str(encoder_path)
+    )
+    quantize_dynamic(str(encoder_path), str(output_dir / 'encoder.int8.onnx'),
+                     weight_type=QuantType.QInt8)
+    encoder_path.unlink()
+    print(f"✅ Encoder exported to: {output_dir / 'encoder.int8.onnx'}")
+
+    # Projection + L2 normalization (tiny, runs after the encoder)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model.projection_head())
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    (output_dir / 'projection.tflite').write_bytes(converter.convert())
+    print(f"✅ Projection head exported to: {output_dir / 'projection.tflite'}")
+
+
 def step3_export_model():
     """Step 3: Export model for JavaScript"""
     print("\n" + "="*60)
@@ -133,28 +182,60 @@ def step3_export_model():
 
     try:
         # Load the trained model
-        checkpoint_path = model_dir / 'checkpoints' / 'best_embedder.h5'
+        checkpoint_path = tf.train.latest_checkpoint(str(model_dir / 'checkpoints'))
 
-        if not checkpoint_path.exists():
-            print(f"❌ Model checkpoint not found at {checkpoint_path}")
+        if checkpoint_path is None:
+            print(f"❌ Model checkpoint not found in {model_dir / 'checkpoints'}")
             return False
 
+        # Export in float32, regardless of the training precision policy
+        tf.keras.mixed_precision.set_global_policy('float32')
+
         model = JapaneseSentenceEmbedder(
             base_model_name='cl-tohoku/bert-base-japanese-v3',
             embedding_dim=384,
             hidden_dim=512
         )
-        model.load_weights(str(checkpoint_path))
-
-        # Save in TensorFlow.js format
-        tf.saved_model.save(model, str(output_dir))
+        # Frozen encoder weights come from the pretrained model; the checkpoint
+        # only holds the projection head and the fine-tuned top layers
+        model.encode(['こんにちは'])
+        model.checkpoint(num_layers=4).restore(checkpoint_path).expect_partial()
+    except Exception as e:
+        print(f"❌ Error loading model: {e}")
+        return False
 
-        print(f"✅ Model exported to: {output_dir}")
+    # Quantized artifacts for CPU inference (optional dependencies),
+    # independent of whether the TF.js conversion below succeeds
+    try:
+        export_quantized_model(model, model_dir / 'japanese_embedder_int8')
+    except ImportError:
+        print("💡 For int8 ONNX/TFLite export: pip install tf2onnx onnxruntime")
+    except Exception as e:
+        print(f"⚠️  Quantized export failed: {e}")
 
-        # Create model.json for tfjs-node
+    try:
+        # SavedModel with an explicit serving signature (the subclassed model
+        # cannot go through Keras .h5 serialization)
+        @tf.function(input_signature=(
+            tf.TensorSpec((None, None), tf.int32, name='input_ids'),
+            tf.TensorSpec((None, None), tf.int32, name='attention_mask'),
+        ))
+        def serving_fn(input_ids, attention_mask):
+            return {'embeddings': model(input_ids=input_ids, attention_mask=attention_mask, training=False)}
+
+        saved_model_dir = output_dir / 'saved_model'
+        tf.saved_model.save(model, str(saved_model_dir), signatures={'serving_default': serving_fn})
+        print(f"✅ SavedModel exported to: {saved_model_dir}")
+
+        # Create model.json for tfjs-node from the SavedModel (uint8-quantized weights)
         import tensorflowjs as tfjs
-        tfjs.converters.save_keras_model(model, str(output_dir))
+        tfjs.converters.convert_tf_saved_model(
+            str(saved_model_dir),
+            str(output_dir),
+            quantization_dtype_map={'uint8': '*'}
+        )
 
+        print(f"✅ Model exported to: {output_dir}")
         print("✅ Model converted to TensorFlow.js format")
         return True
     except Exception as e:
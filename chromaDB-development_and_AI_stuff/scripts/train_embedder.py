@@ -1,122 +1,486 @@
 # scripts/train_embedder.py
 # pyright: reportAttributeAccessIssue=false
 import tensorflow as tf
-from models.japanese_embedder import JapaneseSentenceEmbedder, ContrastiveLoss
+import numpy as np
+from pathlib import Path
+from models.japanese_embedder import JapaneseSentenceEmbedder, ContrastiveLoss, enable_mixed_precision
+from scripts.prepare_training_data import texts_fingerprint, tokens_fingerprint
 import pandas as pd
 from tqdm import tqdm
 #import wandb  # optional: pentru tracking
 
 class EmbeddingTrainer:
-    def __init__(self, model, learning_rate=2e-5):
+    def __init__(self, model, learning_rate=2e-5, cache_dir=None, strategy=None, accum_steps=1,
+                 checkpoint_dir='models/checkpoints'):
         self.model = model
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.learning_rate = learning_rate
+        self.accum_steps = accum_steps
+        self.max_length = 512
         self.loss_fn = ContrastiveLoss(temperature=0.05)
-        self.optimizer = tf.keras.optimizers.Adam(learning_rate) 
-        
-        # Metrics
-        self.train_loss_tracker = tf.keras.metrics.Mean()
-        self.val_loss_tracker = tf.keras.metrics.Mean()
-        
-    def create_dataset(self, df, batch_size=16):
-        """Creează TensorFlow dataset din DataFrame"""
-        def generator():
-            for _, row in df.iterrows():
-                yield (row['text1'], row['text2'], row['label'])
-        
-        dataset = tf.data.Dataset.from_generator(
-            generator,
-            output_signature=(
-                tf.TensorSpec(shape=(), dtype=tf.string), #type: ignore
-                tf.TensorSpec(shape=(), dtype=tf.string), #type: ignore
-                tf.TensorSpec(shape=(), dtype=tf.float32) #type: ignore
-            )
-        )
+
+        # Modelul trebuie construit în strategy.scope() de către apelant
+        self.strategy = strategy or tf.distribute.get_strategy()
+
+        # XLA nu compilează all_gather-ul din ContrastiveLoss: pe mai multe replici
+        # forward/backward-ul rulează ca graf obișnuit, pe o singură replică cu jit_compile
+        jit_compile = self.strategy.num_replicas_in_sync == 1
+        for name in ('projection_gradients', 'full_gradients', 'projection_eval_loss', 'eval_loss'):
+            setattr(self, name, tf.function(getattr(self, name), jit_compile=jit_compile))
+
+        # float16 are nevoie de loss scaling; bfloat16 nu
+        self.loss_scaling = tf.keras.mixed_precision.global_policy().name == 'mixed_float16'
+
+        with self.strategy.scope():
+            self.optimizer = self.create_optimizer()
+
+            # Metrics
+            self.train_loss_tracker = tf.keras.metrics.Mean()
+            self.val_loss_tracker = tf.keras.metrics.Mean()
+
+        self.accum_grads = []
+        self.accum_vars = []
+
+        # Straturile transformer deblocate în faza 2 (aceleași și în checkpoint)
+        self.unfreeze_layers = 4
+        self.build_checkpoint()
+
+        # Early stopping + reducere LR la platou
+        self.patience = 2
+        self.min_delta = 1e-4
+        self.lr_decay = 0.5
+        self.bad_epochs = 0
+        self.best_val = float('inf')
+        self.lr_scale = 1.0
+
+        # Warmup liniar pe primele 10% din pași (rețeta standard de fine-tuning BERT)
+        self.warmup_ratio = 0.1
+        self.warmup_steps = 0
+        self.global_step = 0
+
+    def create_optimizer(self):
+        """Adam (înfășurat în LossScaleOptimizer pentru float16)"""
+        optimizer = tf.keras.optimizers.Adam(self.learning_rate)
+        if self.loss_scaling:
+            optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+        return optimizer
+
+    def build_checkpoint(self):
+        """Checkpoint incremental: projection + straturile deblocate + optimizer"""
+        self.ckpt = self.model.checkpoint(num_layers=self.unfreeze_layers, optimizer=self.optimizer)
+        self.ckpt_mgr = tf.train.CheckpointManager(self.ckpt, str(self.checkpoint_dir), max_to_keep=3)
+
+    def start_warmup(self, num_epochs, steps_per_epoch):
+        """Warmup nou pe primele 10% din pașii fazei curente"""
+        self.global_step = 0
+        self.warmup_steps = max(1, int(self.warmup_ratio * num_epochs * steps_per_epoch))
+
+    def update_learning_rate(self):
+        """LR = learning_rate * factor de warmup * factor de decay la platou"""
+        warmup = min(1.0, (self.global_step + 1) / self.warmup_steps) if self.warmup_steps else 1.0
+        self.optimizer.learning_rate.assign(self.learning_rate * warmup * self.lr_scale)
+
+    def build_accumulators(self, variables):
+        """Gradienți acumulați local pe fiecare replică (fără all-reduce între micro-step-uri)"""
+        self.accum_vars = list(variables)
+
+        # tf.function nou: trace-ul vechi ar păstra optimizer-ul și acumulatorii fazei anterioare
+        self.flush_gradients = tf.function(self.apply_accumulated)
+
+        if self.accum_steps == 1:
+            self.accum_grads = []
+            return
+
+        with self.strategy.scope():
+            self.accum_grads = [
+                tf.Variable(
+                    tf.zeros_like(var),
+                    trainable=False,
+                    synchronization=tf.VariableSynchronization.ON_READ,
+                    aggregation=tf.VariableAggregation.SUM
+                )
+                for var in variables
+            ]
         
-        return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
-    
-    @tf.function
-    def train_step(self, text1_batch, text2_batch, labels):
-        """Training step cu gradient tape"""
-        # Tokenize
-        tokens1 = self.model.tokenizer(
-            text1_batch.numpy().decode('utf-8') if isinstance(text1_batch, bytes) else list(text1_batch.numpy()),
-            padding=True,
+    def tokenize(self, texts):
+        """Tokenizează toate textele o singură dată"""
+        encoded = self.model.tokenizer(
+            texts,
+            padding='max_length',
             truncation=True,
-            max_length=512,
-            return_tensors='tf'
+            max_length=self.max_length,
+            return_tensors='np'
         )
-        
-        tokens2 = self.model.tokenizer(
-            text2_batch.numpy().decode('utf-8') if isinstance(text2_batch, bytes) else list(text2_batch.numpy()),
-            padding=True,
-            truncation=True,
-            max_length=512,
-            return_tensors='tf'
+        return encoded['input_ids'].astype('int32'), encoded['attention_mask'].astype('int32')
+
+    def tokens_fingerprint(self, df):
+        """Amprenta token-urilor pentru df cu tokenizer-ul și max_length curente"""
+        return tokens_fingerprint(df, self.model.tokenizer.name_or_path, self.max_length)
+
+    def load_tokens(self, name, df):
+        """Încarcă token-urile salvate de prepare_training_data, dacă sunt încă valide"""
+        if self.cache_dir is None or name is None:
+            return None
+
+        path = self.cache_dir / f'{name}_tokens.npz'
+        if not path.exists():
+            return None
+
+        tokens = dict(np.load(path))
+        # Textele, tokenizer-ul sau max_length s-au schimbat -> token-uri învechite
+        fingerprint = tokens.pop('fingerprint', None)
+        if fingerprint is None or str(fingerprint) != self.tokens_fingerprint(df):
+            return None
+
+        return tokens
+
+    def save_tokens(self, name, df, tokens):
+        """Salvează token-urile ca următoarele rulări să nu re-tokenizeze"""
+        if self.cache_dir is None or name is None:
+            return
+
+        np.savez(self.cache_dir / f'{name}_tokens.npz',
+                 fingerprint=np.array(self.tokens_fingerprint(df)), **tokens)
+
+    def val_batch_size(self, num_rows, batch_size=16):
+        """Mărimea (fixă) a batch-urilor de validare; 0 dacă setul e prea mic pentru InfoNCE"""
+        size = min(batch_size, num_rows)
+        size -= size % self.strategy.num_replicas_in_sync
+        return size if size >= 2 else 0
+
+    def batch_dataset(self, dataset, num_rows, batch_size=16, training=True):
+        """Shuffle + batch + prefetch, distribuit pe replici"""
+        if training:
+            dataset = dataset.shuffle(num_rows, reshuffle_each_iteration=True)
+            # Batch-uri de formă fixă la training: XLA nu mai recompilează pentru ultimul batch
+            drop_remainder = num_rows >= batch_size or self.strategy.num_replicas_in_sync > 1
+        else:
+            # Loss-ul InfoNCE depinde de mărimea batch-ului (~log B): validarea folosește
+            # doar batch-uri complete, de aceeași mărime, ca epocile să fie comparabile
+            batch_size = self.val_batch_size(num_rows, batch_size)
+            drop_remainder = True
+
+        dataset = (dataset
+                   .batch(batch_size, drop_remainder=drop_remainder)
+                   .prefetch(tf.data.AUTOTUNE))
+
+        return self.strategy.experimental_distribute_dataset(dataset)
+
+    def create_dataset(self, df, batch_size=16, name=None, training=True):
+        """Creează TensorFlow dataset pre-tokenizat din DataFrame"""
+        tokens = self.load_tokens(name, df)
+        if tokens is None:
+            ids1, mask1 = self.tokenize(df['text1'].astype(str).tolist())
+            ids2, mask2 = self.tokenize(df['text2'].astype(str).tolist())
+            tokens = {'ids1': ids1, 'mask1': mask1, 'ids2': ids2, 'mask2': mask2}
+            self.save_tokens(name, df, tokens)
+
+        # cache() înainte de shuffle: fiecare epocă reamestecă aceleași elemente memorate
+        dataset = tf.data.Dataset.from_tensor_slices(tokens).cache()
+
+        return self.batch_dataset(dataset, len(df), batch_size, training)
+    
+    def tokenized_text_dataset(self, texts, batch_size=64):
+        """Tokenizare în tf.data (prefetch), suprapusă cu forward-ul pe GPU"""
+        def tokenize_batch(batch):
+            return self.tokenize([text.decode('utf-8') for text in batch.numpy()])
+
+        def tokenize_fn(batch):
+            ids, mask = tf.py_function(tokenize_batch, [batch], [tf.int32, tf.int32])
+            ids.set_shape([None, None])
+            mask.set_shape([None, None])
+            return ids, mask
+
+        # Ordinea se păstrează (deterministic implicit): rezultatele se scriu după poziție
+        return (tf.data.Dataset.from_tensor_slices(texts)
+                .batch(batch_size)
+                .map(tokenize_fn, num_parallel_calls=tf.data.AUTOTUNE)
+                .prefetch(tf.data.AUTOTUNE))
+
+    @tf.function(jit_compile=True)
+    def pool_step(self, input_ids, attention_mask):
+        """Forward prin encoder-ul înghețat + mean pooling"""
+        return self.model.pool(input_ids, attention_mask, training=False)
+
+    def precompute_pooled(self, texts, batch_size=64):
+        """Rulează encoder-ul înghețat o singură dată pe fiecare text unic"""
+        cache_path = self.cache_dir / 'pooled_cache.npz' if self.cache_dir else None
+
+        # Vectorii depind de texte, encoder, max_length și precizia forward-ului
+        fingerprint = texts_fingerprint(
+            texts,
+            self.model.encoder.config.name_or_path,
+            self.max_length,
+            tf.keras.mixed_precision.global_policy().name
         )
-        
+
+        if cache_path is not None and cache_path.exists():
+            cached = np.load(cache_path, allow_pickle=False)
+            if 'fingerprint' in cached and str(cached['fingerprint']) == fingerprint:
+                print(f"📦 Loaded pooled encoder outputs from {cache_path}")
+                return cached['vectors']
+
+        hidden_size = self.model.encoder.config.hidden_size
+        vectors = np.empty((len(texts), hidden_size), dtype=np.float16)
+
+        offset = 0
+        for ids, mask in tqdm(self.tokenized_text_dataset(texts, batch_size), desc="Encoding"):
+            pooled = self.pool_step(ids, mask)
+            vectors[offset:offset+len(pooled)] = tf.cast(pooled, tf.float16).numpy()
+            offset += len(pooled)
+
+        if cache_path is not None:
+            np.savez(cache_path, fingerprint=np.array(fingerprint), vectors=vectors)
+
+        return vectors
+
+    def create_pooled_dataset(self, df, vectors, index, batch_size=16, training=True):
+        """Dataset cu vectori pre-calculați pentru faza cu encoder înghețat"""
+        idx1 = df['text1'].astype(str).map(index).values
+        idx2 = df['text2'].astype(str).map(index).values
+
+        dataset = tf.data.Dataset.from_tensor_slices({
+            'vec1': vectors[idx1],
+            'vec2': vectors[idx2]
+        })
+
+        return self.batch_dataset(dataset, len(df), batch_size, training)
+
+    def scale_loss(self, loss):
+        """Scalează loss-ul per replică pentru all-reduce (SUM) și gradient accumulation"""
+        loss = loss / (self.strategy.num_replicas_in_sync * self.accum_steps)
+        if self.loss_scaling:
+            loss = self.optimizer.get_scaled_loss(loss)
+        return loss
+
+    def unscale_gradients(self, gradients):
+        if self.loss_scaling:
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
+        return gradients
+
+    def projection_gradients(self, vec1, vec2):
+        """Forward + backward doar pentru projection head (encoder înghețat)"""
+        with tf.GradientTape() as tape:
+            embeddings1 = self.model.project(vec1, training=True)
+            embeddings2 = self.model.project(vec2, training=True)
+
+            loss = self.loss_fn(embeddings1, embeddings2)
+            scaled_loss = self.scale_loss(loss)
+
+        gradients = tape.gradient(scaled_loss, self.model.projection.trainable_variables)
+        return loss, self.unscale_gradients(gradients)
+
+    def full_gradients(self, ids1, mask1, ids2, mask2):
+        """Forward + backward prin encoder și projection head"""
         with tf.GradientTape() as tape:
             # Forward pass
             embeddings1 = self.model(
-                input_ids=tokens1['input_ids'],
-                attention_mask=tokens1['attention_mask'],
+                input_ids=ids1,
+                attention_mask=mask1,
                 training=True
             )
             
             embeddings2 = self.model(
-                input_ids=tokens2['input_ids'],
-                attention_mask=tokens2['attention_mask'],
+                input_ids=ids2,
+                attention_mask=mask2,
                 training=True
             )
             
             # Compute loss
-            loss = self.loss_fn(embeddings1, embeddings2, labels)
+            loss = self.loss_fn(embeddings1, embeddings2)
+            scaled_loss = self.scale_loss(loss)
         
         # Backward pass
-        gradients = tape.gradient(loss, self.model.trainable_variables)
-        if gradients is not None:
-            self.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
-        
+        gradients = tape.gradient(scaled_loss, self.model.trainable_variables)
+        return loss, self.unscale_gradients(gradients)
+
+    def apply_gradients(self, loss, gradients, variables, apply):
+        """Acumulează local; optimizer-ul (și all-reduce-ul) rulează doar la ultimul micro-step"""
         self.train_loss_tracker.update_state(loss)
-        return loss
+
+        if self.accum_steps == 1:
+            self.optimizer.apply_gradients(
+                (grad, var) for grad, var in zip(gradients, variables) if grad is not None
+            )
+            return
+
+        for accum, grad in zip(self.accum_grads, gradients):
+            if grad is not None:
+                accum.assign_add(grad)
+
+        if apply:
+            self.optimizer.apply_gradients(
+                zip([accum.read_value() for accum in self.accum_grads], variables)
+            )
+            for accum in self.accum_grads:
+                accum.assign(tf.zeros_like(accum))
+
+    def apply_accumulated(self, scale):
+        """Aplică micro-step-urile rămase la sfârșitul epocii (update parțial, re-scalat)"""
+        def step_fn():
+            self.optimizer.apply_gradients(
+                zip([accum.read_value() * scale for accum in self.accum_grads], self.accum_vars)
+            )
+            for accum in self.accum_grads:
+                accum.assign(tf.zeros_like(accum))
+
+        self.strategy.run(step_fn)
+
+    @tf.function
+    def projection_train_step(self, batch, apply=True):
+        """Training step distribuit doar pentru projection head"""
+        def step_fn(batch):
+            loss, gradients = self.projection_gradients(**batch)
+            self.apply_gradients(loss, gradients, self.model.projection.trainable_variables, apply)
+
+        self.strategy.run(step_fn, args=(batch,))
+
+    @tf.function
+    def train_step(self, batch, apply=True):
+        """Training step distribuit cu gradient tape"""
+        def step_fn(batch):
+            loss, gradients = self.full_gradients(**batch)
+            self.apply_gradients(loss, gradients, self.model.trainable_variables, apply)
+
+        self.strategy.run(step_fn, args=(batch,))
     
-    def train(self, train_df, val_df, epochs=10, batch_size=16):
+    def projection_eval_loss(self, vec1, vec2):
+        """Loss pe vectori pre-calculați (fără gradient tape)"""
+        embeddings1 = self.model.project(vec1, training=False)
+        embeddings2 = self.model.project(vec2, training=False)
+
+        return self.loss_fn(embeddings1, embeddings2)
+
+    def eval_loss(self, ids1, mask1, ids2, mask2):
+        """Loss pe input_ids (fără gradient tape)"""
+        embeddings1 = self.model(input_ids=ids1, attention_mask=mask1, training=False)
+        embeddings2 = self.model(input_ids=ids2, attention_mask=mask2, training=False)
+
+        return self.loss_fn(embeddings1, embeddings2)
+
+    @tf.function
+    def projection_val_step(self, batch):
+        """Validation step distribuit pe vectori pre-calculați"""
+        def step_fn(batch):
+            self.val_loss_tracker.update_state(self.projection_eval_loss(**batch))
+
+        self.strategy.run(step_fn, args=(batch,))
+
+    @tf.function
+    def val_step(self, batch):
+        """Validation step distribuit"""
+        def step_fn(batch):
+            self.val_loss_tracker.update_state(self.eval_loss(**batch))
+
+        self.strategy.run(step_fn, args=(batch,))
+
+    def train(self, train_df, val_df, epochs=10, batch_size=16, freeze_epochs=3):
         """Training loop complet"""
-        train_dataset = self.create_dataset(train_df, batch_size)
-        val_dataset = self.create_dataset(val_df, batch_size)
-        
-        best_val_loss = float('inf')
+        # Faza 1: encoder înghețat -> vectorii pooled se calculează o singură dată
+        texts = pd.unique(pd.concat([
+            train_df['text1'], train_df['text2'],
+            val_df['text1'], val_df['text2']
+        ]).astype(str)).tolist()
+        vectors = self.precompute_pooled(texts)
+        index = {text: i for i, text in enumerate(texts)}
+
+        # Construiește toate variabilele modelului (projection nu trece prin call în faza 1)
+        ids, mask = self.tokenize(texts[:1])
+        with self.strategy.scope():
+            self.model(input_ids=ids, attention_mask=mask, training=False)
+        self.build_accumulators(self.model.projection.trainable_variables)
+
+        # Un singur exemplu de validare dă mereu loss 0: fără validare, nu se decide pe zgomot
+        validate = self.val_batch_size(len(val_df), batch_size) > 0
+        if not validate:
+            print("⚠️  Validation set too small for InfoNCE; saving every epoch without LR decay or early stopping")
+
+        train_dataset = self.create_pooled_dataset(train_df, vectors, index, batch_size)
+        val_dataset = self.create_pooled_dataset(val_df, vectors, index, batch_size, training=False) if validate else None
+        step_fn = self.projection_train_step
+        val_step_fn = self.projection_val_step
+
+        steps_per_epoch = max(1, len(train_df) // batch_size)
+        self.start_warmup(min(freeze_epochs, epochs), steps_per_epoch)
+        self.best_val = float('inf')
+        self.bad_epochs = 0
+        self.lr_scale = 1.0
         
         for epoch in range(epochs):
             print(f"\nEpoch {epoch+1}/{epochs}")
             
             # Training
             self.train_loss_tracker.reset_states()
+            pending = 0
             for batch in tqdm(train_dataset, desc="Training"):
-                text1, text2, labels = batch
-                self.train_step(text1, text2, labels)
+                if self.global_step < self.warmup_steps:
+                    self.update_learning_rate()
+                pending = (pending + 1) % self.accum_steps
+                step_fn(batch, apply=pending == 0)
+                self.global_step += 1
+
+            # Micro-step-urile rămase nu trec în epoca următoare (sau se pierd la unfreeze)
+            if pending:
+                self.flush_gradients(tf.constant(self.accum_steps / pending, tf.float32))
             
             train_loss = self.train_loss_tracker.result()
-            
-            # Validation
-            self.val_loss_tracker.reset_states()
-            for batch in tqdm(val_dataset, desc="Validation"):
-                text1, text2, labels = batch
-                # Similar la train_step dar fără gradient tape
-                # ... implementare validare
-            
-            val_loss = self.val_loss_tracker.result()
-            
-            print(f"Train Loss: {train_loss:.4f}, Val Loss: {val_loss:.4f}")
-            
-            # Save best model
-            if val_loss < best_val_loss:
-                best_val_loss = val_loss
-                self.model.save_weights('models/checkpoints/best_embedder.h5')
-                print("✅ Saved best model!")
+
+            if not validate:
+                print(f"Train Loss: {train_loss:.4f}")
+                self.ckpt_mgr.save()
+            else:
+                # Validation
+                self.val_loss_tracker.reset_states()
+                for batch in tqdm(val_dataset, desc="Validation"):
+                    val_step_fn(batch)
+
+                val_loss = self.val_loss_tracker.result()
+
+                print(f"Train Loss: {train_loss:.4f}, Val Loss: {val_loss:.4f}")
+
+                # Save best model
+                if val_loss < self.best_val - self.min_delta:
+                    self.best_val = val_loss
+                    self.bad_epochs = 0
+                    self.ckpt_mgr.save()
+                    print("✅ Saved best model!")
+                else:
+                    self.bad_epochs += 1
+                    self.lr_scale *= self.lr_decay
+                    self.update_learning_rate()
+                    print(f"📉 No improvement, learning rate -> {float(self.optimizer.learning_rate.numpy()):.2e}")
+
+                    # Early stopping doar după ce encoder-ul a fost deblocat
+                    if epoch >= freeze_epochs and self.bad_epochs >= self.patience:
+                        print("⏹️  Early stopping")
+                        break
             
             # Unfreeze encoder după primele 3 epoci
-            if epoch == 2:
+            if epoch == freeze_epochs - 1:
                 print("🔓 Unfreezing encoder layers...")
-                self.model.unfreeze_encoder(num_layers=4)
+                self.model.unfreeze_encoder(num_layers=self.unfreeze_layers)
+
+                # Optimizer-ul e construit doar pentru variabilele din faza 1
+                with self.strategy.scope():
+                    self.optimizer = self.create_optimizer()
+                self.build_accumulators(self.model.trainable_variables)
+
+                # Același Checkpoint (save_counter continuă): fazele nu își suprascriu fișierele
+                self.ckpt.optimizer = self.optimizer
+
+                # Faza nouă: patience, decay și warmup (peste pașii fazei 2) pornesc de la zero
+                self.bad_epochs = 0
+                self.lr_scale = 1.0
+                self.start_warmup(epochs - freeze_epochs, steps_per_epoch)
+                self.update_learning_rate()
+
+                # Faza 2: forward complet pe input_ids tokenizate
+                train_dataset = self.create_dataset(train_df, batch_size, name='train')
+                if validate:
+                    val_dataset = self.create_dataset(val_df, batch_size, name='val', training=False)
+                step_fn = self.train_step
+                val_step_fn = self.val_step
 
 # Usage
 if __name__ == "__main__":
@@ -132,22 +496,31 @@ if __name__ == "__main__":
     model_dir.mkdir(parents=True, exist_ok=True)
 
     # Load data
-    train_df = pd.read_csv(data_dir / 'train.csv')
-    val_df = pd.read_csv(data_dir / 'val.csv')
+    train_df = pd.read_parquet(data_dir / 'train.parquet')
+    val_df = pd.read_parquet(data_dir / 'val.parquet')
 
     print(f"📊 Loaded {len(train_df)} training samples")
     print(f"📊 Loaded {len(val_df)} validation samples")
 
+    # Mixed precision trebuie setat înainte de construirea modelului
+    print(f"⚡ Mixed precision policy: {enable_mixed_precision()}")
+
+    # Multi-GPU: modelul trebuie construit în strategy.scope()
+    strategy = tf.distribute.MirroredStrategy()
+    print(f"🖥️  Replicas in sync: {strategy.num_replicas_in_sync}")
+
     # Initialize model
-    model = JapaneseSentenceEmbedder(
-        base_model_name='cl-tohoku/bert-base-japanese-v3',
-        embedding_dim=384,  # compatible with ChromaDB
-        hidden_dim=512
-    )
+    with strategy.scope():
+        model = JapaneseSentenceEmbedder(
+            base_model_name='cl-tohoku/bert-base-japanese-v3',
+            embedding_dim=384,  # compatible with ChromaDB
+            hidden_dim=512
+        )
 
-    # Train
-    trainer = EmbeddingTrainer(model, learning_rate=2e-5)
-    trainer.train(train_df, val_df, epochs=10, batch_size=16)
+    # Train (accum_steps > 1 emulează un batch mai mare pe GPU-uri cu VRAM mic)
+    trainer = EmbeddingTrainer(model, learning_rate=2e-5, cache_dir=data_dir,
+                               strategy=strategy, accum_steps=1, checkpoint_dir=model_dir)
+    trainer.train(train_df, val_df, epochs=10, batch_size=32)
 
     print("🎉 Training complete!")
-    print(f"✅ Model saved to: {model_dir / 'best_embedder.h5'}")
\ No newline at end of file
+    print(f"✅ Model saved to: {model_dir}")
\ No newline at end of file